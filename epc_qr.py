@@ -6,8 +6,17 @@
 import io
 from typing import Optional
 
-import qrcode
-from qrcode.constants import ERROR_CORRECT_M
+# Основной генератор — segno (быстрее qrcode), qrcode — запасной вариант
+try:
+    import segno
+except ImportError:
+    segno = None
+
+try:
+    import qrcode
+    from qrcode.constants import ERROR_CORRECT_M
+except ImportError:
+    qrcode = None
 
 from upn_parser import UPNPayment
 
@@ -22,38 +31,34 @@ def build_epc_payload(p: UPNPayment, bic: Optional[str] = None) -> str:
     bic = (bic or "").strip()
     name = (p.recipient_name or "")[:70]
     iban = (p.iban or "").replace(" ", "").upper()[:34]
-    amount_str = f"{p.amount:.2f}".replace(".", ",")  # в спецификации пример EUR12.3 — с точкой; многие используют запятую
-    # Для совместимости с Revolut используем точку в сумме
-    amount_str = f"{p.amount:.2f}"
+    # Для совместимости с Revolut используем точку в сумме (как в примере спецификации EUR12.3)
+    amount_str = format(p.amount, ".2f")
     purpose = (p.purpose or "")[:4] if p.purpose else ""
     # Remittance: структурированная (RF) или неструктурированная. SI19 не RF — передаём как неструктурированную
     remittance = (p.reference or "")[:35]
-    if len(remittance) > 35:
-        remittance = remittance[:35]
     # Beneficiary to originator — описание платежа
     b2o = (p.purpose or "")[:70]
 
-    parts = [
-        "BCD",
-        "002",
-        "1",  # UTF-8
-        "SCT",
-        bic,
-        name,
-        iban,
-        "EUR" + amount_str,
-        purpose,
-        remittance,
-        b2o,
-    ]
+    payload = (
+        "BCD\n002\n1\nSCT\n"  # версия 002, набор символов 1 = UTF-8
+        f"{bic}\n{name}\n{iban}\nEUR{amount_str}\n"
+        f"{purpose}\n{remittance}\n{b2o}"
+    )
     # Убираем пустые хвосты (последний элемент без разделителя не должен быть пустым)
-    while len(parts) > 1 and parts[-1] == "":
-        parts.pop()
-    return "\n".join(parts)
+    return payload.rstrip("\n")
 
 
 def payload_to_qr_image(payload: str, box_size: int = 6, border: int = 2) -> bytes:
     """Генерирует PNG-изображение QR-кода. Возвращает bytes (PNG)."""
+    if segno is not None:
+        # EPC: набор символов 1 = UTF-8, поэтому кодировку задаём явно
+        # (иначе segno выберет ISO-8859-1 для строк без č/š/ž); уровень коррекции не повышаем
+        qr = segno.make(payload, error="m", encoding="utf-8", boost_error=False)
+        buf = io.BytesIO()
+        qr.save(buf, kind="png", scale=box_size, border=border)
+        return buf.getvalue()
+    if qrcode is None:
+        raise RuntimeError("QR generator required: pip install segno (or qrcode[pil])")
     qr = qrcode.QRCode(
         version=None,
         error_correction=ERROR_CORRECT_M,
@@ -66,3 +71,11 @@ def payload_to_qr_image(payload: str, box_size: int = 6, border: int = 2) -> byt
     buf = io.BytesIO()
     img.save(buf, format="PNG")
     return buf.getvalue()
+
+
+def payment_to_qr_image(p: UPNPayment, box_size: int = 6, border: int = 2) -> bytes:
+    """
+    EPC QR PNG for one payment. Lives here (not in pdf_io) so that a worker process
+    running it only needs segno/qrcode, not ReportLab/PyMuPDF/OpenCV.
+    """
+    return payload_to_qr_image(build_epc_payload(p), box_size=box_size, border=border)
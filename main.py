@@ -8,8 +8,6 @@ import argparse
 import sys
 from pathlib import Path
 
-from pdf_io import process_pdf
-
 
 def main() -> int:
     parser = argparse.ArgumentParser(
@@ -43,6 +41,9 @@ def main() -> int:
     if output_path is None:
         output_path = input_path.parent / f"{input_path.stem}_epc_qr.pdf"
 
+    # Imported here: pdf_io pulls in ReportLab and PyMuPDF, not needed for --help or a bad path
+    from pdf_io import process_pdf
+
     try:
         payments, raw_text = process_pdf(str(input_path), str(output_path), verbose=args.debug)
     except ValueError as e:
@@ -4,6 +4,10 @@
 итогового PDF с EPC QR-кодами и реестром платежей.
 """
 import io
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
 from typing import List, Tuple
 
 from reportlab.lib import colors
@@ -20,20 +24,69 @@ from reportlab.platypus import (
 )
 
 from upn_parser import UPNPayment
-from epc_qr import build_epc_payload, payload_to_qr_image
+from epc_qr import payment_to_qr_image
 from unp_qr_decode import parse_all_unp_qr_contents
 from pdf_qr_extract import extract_qr_strings_from_pdf
 
 
+_SLO_TRANS = str.maketrans({
+    "\u010d": "c", "\u010c": "C",  # c, C
+    "\u0161": "s", "\u0160": "S",  # s, S
+    "\u017e": "z", "\u017d": "Z",  # z, Z
+})
+
+
 def _ascii_slovenian(s: str) -> str:
     """Replace Slovenian diacritics for PDF display: c, s, z -> c, s, z."""
     if not s:
         return s
-    return (
-        s.replace("\u010d", "c").replace("\u010c", "C")  # c, C
-        .replace("\u0161", "s").replace("\u0160", "S")  # s, S
-        .replace("\u017e", "z").replace("\u017d", "Z")  # z, Z
-    )
+    return s.translate(_SLO_TRANS)
+
+
+# Payment card (description + QR): the same layout for every payment, built once
+_QR_SIZE = 45 * mm
+_DESC_WIDTH = 120 * mm
+_ROW_PAD = 5 * mm  # gap between frame and content (QR / text)
+# Column width = content + padding on both sides so the frame does not overlap content
+_ROW_COL_WIDTHS = (_DESC_WIDTH + 2 * _ROW_PAD, _QR_SIZE + 2 * _ROW_PAD)
+_ROW_TABLE_STYLE = TableStyle([
+    ("VALIGN", (0, 0), (-1, -1), "TOP"),
+    ("LEFTPADDING", (0, 0), (-1, -1), _ROW_PAD),
+    ("RIGHTPADDING", (0, 0), (-1, -1), _ROW_PAD),
+    ("TOPPADDING", (0, 0), (-1, -1), _ROW_PAD),
+    ("BOTTOMPADDING", (0, 0), (-1, -1), _ROW_PAD),
+    ("BOX", (0, 0), (-1, -1), 0.5, colors.lightgrey),
+    ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#f8f9fa")),
+])
+
+
+# From this many payments on (~10 ms of pure Python per QR), QR images are generated in worker processes
+_PARALLEL_QR_MIN = 32
+
+# EPC QR PNG for one payment as it appears in the output PDF (picklable for the process pool)
+_render_qr = partial(payment_to_qr_image, box_size=5, border=2)
+
+
+def _render_qr_images(payments: List[UPNPayment]) -> List[bytes]:
+    """
+    EPC QR PNGs for all payments, in order. Generation is CPU-bound pure Python,
+    so large registers use a process pool; small ones (or if the pool fails) run inline.
+    The pool is used only with the fork start method: with spawn/forkserver (macOS, Windows)
+    every worker re-imports the modules first, which costs more than it saves.
+    """
+    workers = min(len(payments), os.cpu_count() or 1)
+    if (
+        len(payments) >= _PARALLEL_QR_MIN
+        and workers > 1
+        and multiprocessing.get_start_method() == "fork"
+    ):
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as ex:
+                chunksize = max(1, len(payments) // (workers * 4))
+                return list(ex.map(_render_qr, payments, chunksize=chunksize))
+        except Exception:
+            pass
+    return [_render_qr(p) for p in payments]
 
 
 def build_output_pdf(
@@ -67,11 +120,12 @@ def build_output_pdf(
     story.append(Paragraph("Payment register", styles["Heading2"]))
     story.append(Spacer(1, 2 * mm))
 
-    total = sum(p.amount for p in payments)
+    total = 0.0
     table_data = [
         ["#", "Recipient", "Reference", "Amount (EUR)", "QR"],
     ]
     for idx, p in enumerate(payments, 1):
+        total += p.amount
         rec = _ascii_slovenian(p.recipient_name or "")
         table_data.append([
             str(idx),
@@ -105,16 +159,10 @@ def build_output_pdf(
     story.append(Paragraph("Payment QR codes (EPC SCT)", styles["Heading2"]))
     story.append(Spacer(1, 2 * mm))
 
-    qr_size = 45 * mm
-    desc_width = 120 * mm
-    pad = 5 * mm  # gap between frame and content (QR / text)
-    # Column width = content + padding on both sides so the frame does not overlap content
-    col0_width = desc_width + 2 * pad
-    col1_width = qr_size + 2 * pad
-    for idx, p in enumerate(payments, 1):
-        payload = build_epc_payload(p)
-        qr_bytes = payload_to_qr_image(payload, box_size=5, border=2)
-        img = Image(io.BytesIO(qr_bytes), width=qr_size, height=qr_size)
+    desc_style = styles["Normal"]
+    qr_images = _render_qr_images(payments)
+    for idx, (p, qr_bytes) in enumerate(zip(payments, qr_images), 1):
+        img = Image(io.BytesIO(qr_bytes), width=_QR_SIZE, height=_QR_SIZE)
 
         rec = _ascii_slovenian(p.recipient_name or "")
         purp = _ascii_slovenian(p.purpose)
@@ -124,19 +172,11 @@ def build_output_pdf(
             f"IBAN {p.iban} &middot; {p.amount:.2f} EUR<br/>"
             f"Ref. {p.reference}<br/>"
             f"{purp_show}",
-            styles["Normal"],
+            desc_style,
         )
         row_data = [[desc_para, img]]
-        tbl = Table(row_data, colWidths=[col0_width, col1_width])
-        tbl.setStyle(TableStyle([
-            ("VALIGN", (0, 0), (-1, -1), "TOP"),
-            ("LEFTPADDING", (0, 0), (-1, -1), pad),
-            ("RIGHTPADDING", (0, 0), (-1, -1), pad),
-            ("TOPPADDING", (0, 0), (-1, -1), pad),
-            ("BOTTOMPADDING", (0, 0), (-1, -1), pad),
-            ("BOX", (0, 0), (-1, -1), 0.5, colors.lightgrey),
-            ("BACKGROUND", (0, 0), (-1, -1), colors.HexColor("#f8f9fa")),
-        ]))
+        tbl = Table(row_data, colWidths=_ROW_COL_WIDTHS)
+        tbl.setStyle(_ROW_TABLE_STYLE)
         story.append(tbl)
         # Увеличенный промежуток между платежами — удобнее сканировать один QR, не задевая соседний
         if idx < len(payments):
@@ -178,7 +218,7 @@ def process_pdf(input_pdf: str, output_pdf: str, verbose: bool = False) -> Tuple
 
 def format_payment_register_text(payments: List[UPNPayment]) -> str:
     """Format payment register as plain text (e.g. for email body)."""
-    total = sum(p.amount for p in payments)
+    total = 0.0
     lines = [
         "Payment register",
         "",
@@ -186,6 +226,7 @@ def format_payment_register_text(payments: List[UPNPayment]) -> str:
         "-" * 60,
     ]
     for idx, p in enumerate(payments, 1):
+        total += p.amount
         rec = _ascii_slovenian(p.recipient_name or "")
         rec_short = (rec[:50] + "...") if len(rec) > 50 else rec
         lines.append(f"{idx}\t{rec_short}\t{p.reference}\t{p.amount:.2f}")
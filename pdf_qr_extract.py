@@ -4,7 +4,10 @@
 Используется для чтения UNP/UPN QR из платёжных поручений.
 """
 import io
-from typing import List, Optional
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, List, Optional, Tuple
 
 try:
     import fitz  # PyMuPDF
@@ -16,17 +19,32 @@ try:
 except ImportError:
     Image = None
 
-# pyzbar требует системную библиотеку libzbar (brew install zbar)
+# Быстрый вариант: fastzbarlight (libzbar собрана с -O3, в комплекте, pip install fastzbarlight).
+# Результат оборачиваем в объекты с атрибутом .data, как у pyzbar.
 _pyzbar_decode = None
 try:
-    from pyzbar.pyzbar import decode as _pyzbar_decode_func
-    from pyzbar.pyzbar import ZBarSymbol
+    import fastzbarlight
+    from collections import namedtuple
+    _ZbarResult = namedtuple("_ZbarResult", "data")
     def _pyzbar_decode(img: "Image.Image"):
-        return _pyzbar_decode_func(img, symbols=[ZBarSymbol.QRCODE])
+        if img.mode != "L":
+            img = img.convert("L")
+        return [_ZbarResult(d) for d in fastzbarlight.scan_codes("qrcode", img) or []]
     _pyzbar_decode = _pyzbar_decode
 except Exception:
     pass
 
+# pyzbar требует системную библиотеку libzbar (brew install zbar)
+if _pyzbar_decode is None:
+    try:
+        from pyzbar.pyzbar import decode as _pyzbar_decode_func
+        from pyzbar.pyzbar import ZBarSymbol
+        def _pyzbar_decode(img: "Image.Image"):
+            return _pyzbar_decode_func(img, symbols=[ZBarSymbol.QRCODE])
+        _pyzbar_decode = _pyzbar_decode
+    except Exception:
+        pass
+
 # Запасной декодер: OpenCV (pip install opencv-python-headless)
 # Используем detect + decodeBytes, чтобы получить сырые байты и декодировать сами
 # (detectAndDecode внутри OpenCV делает UTF-8 decode и падает на Latin-2/ECI).
@@ -39,41 +57,45 @@ try:
         cv2.utils.logging.setLogLevel(cv2.utils.logging.LOG_LEVEL_SILENT)
     except Exception:
         pass
-    _cv2_detector = cv2.QRCodeDetector()
+    # Страницы декодируются в нескольких потоках, а QRCodeDetector хранит
+    # состояние между detect и decode — держим по одному детектору на поток.
+    _cv2_local = threading.local()
+
+    def _get_cv2_detector() -> "cv2.QRCodeDetector":
+        detector = getattr(_cv2_local, "detector", None)
+        if detector is None:
+            detector = _cv2_local.detector = cv2.QRCodeDetector()
+        return detector
 
     def _cv2_decode(img: "Image.Image") -> List[str]:
-        arr = np.array(img)
-        if len(arr.shape) == 3 and arr.shape[2] == 3:
-            arr_bgr = cv2.cvtColor(arr, cv2.COLOR_RGB2BGR)
-        else:
-            arr_bgr = arr
-        # Try grayscale first (often more reliable for QR on rendered PDFs)
-        if len(arr_bgr.shape) == 3:
-            arr_gray = cv2.cvtColor(arr_bgr, cv2.COLOR_BGR2GRAY)
-        else:
-            arr_gray = arr_bgr
-        for im in (arr_gray, arr_bgr):
-            retval, points = _cv2_detector.detect(im)
-            if not retval or points is None or (hasattr(points, "size") and points.size == 0):
-                continue
-            result: List[str] = []
-            try:
-                data_bytes, _ = _cv2_detector.decodeBytes(im, points)
-            except Exception:
-                data_bytes = None
-            if data_bytes is not None and len(data_bytes) > 0:
-                s = _normalize_qr_content_to_str(data_bytes)
-                if s.strip():
-                    result.append(s)
-            if not result:
-                try:
-                    data, _, _ = _cv2_detector.detectAndDecode(im)
-                    if data and isinstance(data, str) and data.strip():
-                        result = [_normalize_qr_content_to_str(data)]
-                except Exception:
-                    pass
-            if result:
-                return result
+        """Decode QR with OpenCV; img is 8-bit grayscale (see _decode_qr_from_image)."""
+        _cv2_detector = _get_cv2_detector()
+        im = np.asarray(img)  # no extra copy: the detector only reads the buffer
+        retval, points = _cv2_detector.detect(im)
+        if not retval or points is None or (hasattr(points, "size") and points.size == 0):
+            return []
+        try:
+            data_bytes, _ = _cv2_detector.decodeBytes(im, points)
+        except Exception:
+            data_bytes = None
+        if data_bytes is not None and len(data_bytes) > 0:
+            s = _normalize_qr_content_to_str(data_bytes)
+            if s.strip():
+                return [s]
+        # Reuse the points from detect() instead of detectAndDecode (which detects again)
+        try:
+            data, _ = _cv2_detector.decode(im, points)
+            if data and isinstance(data, str) and data.strip():
+                return [_normalize_qr_content_to_str(data)]
+        except Exception:
+            pass
+        # Last resort: multi-code detection may pick up a code detect() framed wrongly
+        try:
+            ok, decoded_info, _, _ = _cv2_detector.detectAndDecodeMulti(im)
+            if ok:
+                return [_normalize_qr_content_to_str(d) for d in decoded_info if d and d.strip()]
+        except Exception:
+            pass
         return []
     _cv2_decode = _cv2_decode
 except Exception:
@@ -87,38 +109,52 @@ def _normalize_qr_content_to_str(raw: "str | bytes") -> str:
     """
     if raw is None:
         return ""
-    if not isinstance(raw, (str, bytes, bytearray)):
-        raw = bytes(raw) if hasattr(raw, "tobytes") else str(raw)
     if isinstance(raw, str):
+        return raw
+    if not isinstance(raw, (bytes, bytearray)):
+        if not hasattr(raw, "tobytes"):
+            return str(raw)
+        raw = bytes(raw)
+    # Fast path: UTF-8 (most QR decoders hand us bytes that are valid UTF-8)
+    try:
+        return raw.decode("utf-8")
+    except UnicodeDecodeError:
+        pass
+    for enc in ("iso-8859-2", "cp1250", "latin-1"):
         try:
-            raw.encode("utf-8")
-            return raw
-        except UnicodeEncodeError:
-            raw = raw.encode("latin-1")
-    if isinstance(raw, (bytes, bytearray)):
-        for enc in ("utf-8", "iso-8859-2", "cp1250", "latin-1"):
-            try:
-                return raw.decode(enc)
-            except (UnicodeDecodeError, LookupError):
-                continue
-        return raw.decode("utf-8", errors="replace")
-    return str(raw)
+            return raw.decode(enc)
+        except (UnicodeDecodeError, LookupError):
+            continue
+    return raw.decode("utf-8", errors="replace")
 
 
 def _page_to_pil_image(doc: "fitz.Document", page_no: int, dpi: int = 200) -> Optional["Image.Image"]:
-    """Рендер одной страницы PDF в PIL Image."""
+    """Рендер одной страницы PDF в PIL Image (оттенки серого, режим "L")."""
     if fitz is None or Image is None:
         return None
     page = doc[page_no]
-    zoom = dpi / 72.0
-    mat = fitz.Matrix(zoom, zoom)
-    pix = page.get_pixmap(matrix=mat, alpha=False)
-    return Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    # Both zbar and the OpenCV detector work on grayscale: render 1 byte/pixel instead of RGB
+    pix = page.get_pixmap(dpi=dpi, alpha=False, colorspace=fitz.csGRAY)
+    # frombuffer wraps pix.samples without copying it once more (frombytes would)
+    return Image.frombuffer("L", (pix.width, pix.height), pix.samples, "raw", "L", 0, 1)
+
+
+def _has_upnqr(strings: List[str]) -> bool:
+    """True, если среди строк есть содержимое UPN QR."""
+    return any(s.strip().startswith("UPNQR") for s in strings)
+
+
+# Нас интересует только UPN QR: если zbar уже нашёл его, OpenCV не запускаем
+_REQUIRE_UPNQR = True
 
 
 def _decode_qr_from_image(img: "Image.Image") -> List[str]:
     """Decode all QR codes on the image. Run both pyzbar and OpenCV and merge results
-    so we don't miss UPN QR when another QR (e.g. numeric ID) is also present."""
+    so we don't miss UPN QR when another QR (e.g. numeric ID) is also present.
+    With _REQUIRE_UPNQR, OpenCV is skipped once pyzbar has returned UPN QR.
+    The image is converted to 8-bit grayscale once and that one buffer feeds both decoders."""
+    if img.mode != "L":
+        img = img.convert("L")
     seen: set = set()
     result: List[str] = []
 
@@ -131,38 +167,66 @@ def _decode_qr_from_image(img: "Image.Image") -> List[str]:
         for obj in _pyzbar_decode(img):
             data = _normalize_qr_content_to_str(obj.data)
             add(data)
+        # OpenCV is only needed as a second opinion when zbar missed the UPN QR
+        if _REQUIRE_UPNQR and _has_upnqr(result):
+            return result
     if _cv2_decode is not None:
         for s in _cv2_decode(img):
             add(s)
     return result
 
 
-def _decode_qr_from_pil(pil_img: "Image.Image") -> List[str]:
-    """Декодирует QR из PIL Image; конвертирует в RGB если нужно."""
-    if pil_img.mode != "RGB":
-        pil_img = pil_img.convert("RGB")
-    return _decode_qr_from_image(pil_img)
+def _open_pil(blob: bytes) -> Optional["Image.Image"]:
+    """Открывает изображение из байтов; None, если PIL не смог его прочитать."""
+    try:
+        return Image.open(io.BytesIO(blob))
+    except Exception:
+        return None
+
+
+def _xref_to_pil(doc: "fitz.Document", xref: int) -> Optional["Image.Image"]:
+    """
+    Image by xref as PIL Image. Takes the pixels PyMuPDF has already decoded
+    (fitz.Pixmap), so PIL does not sniff and decode the stream (JPEG etc.) a second time;
+    extract_image + PIL is the fallback for what Pixmap cannot handle (e.g. JBIG2, masks).
+    None if the xref is not a readable image.
+    """
+    try:
+        pix = fitz.Pixmap(doc, xref)
+        if pix.alpha:
+            pix = fitz.Pixmap(pix, 0)
+        if pix.n != 1:
+            # The decoders work on grayscale anyway
+            pix = fitz.Pixmap(fitz.csGRAY, pix)
+        return Image.frombytes("L", (pix.width, pix.height), pix.samples)
+    except Exception:
+        pass
+    try:
+        base = doc.extract_image(xref)
+    except Exception:
+        return None
+    if not base:
+        return None
+    blob = base.get("image") or base.get("data")
+    return _open_pil(blob) if blob else None
 
 
-def _extract_embedded_images(doc: "fitz.Document") -> List["Image.Image"]:
+def _extract_embedded_images(
+    doc: "fitz.Document",
+    already_found: Optional[Callable[[], bool]] = None,
+) -> Iterator[Tuple[Optional[int], "Image.Image"]]:
     """
-    Extract all embedded images from PDF as PIL Image:
-    1) images by xref (page.get_images() + doc.extract_image);
+    Yield all embedded images from PDF as (page_no, PIL Image), one at a time
+    (the caller decodes and closes each, so they are never all in memory):
+    1) images by xref (page.get_images() + fitz.Pixmap / doc.extract_image);
     2) inline images from page stream (get_text("dict"), type==1);
-    3) any image xref in the document (in case get_images() misses some).
+    3) any image xref in the document (in case get_images() misses some) — page_no is None.
+    Pass 3 is skipped when already_found() returns True after passes 1-2.
     """
     if fitz is None or Image is None:
-        return []
-    out: List["Image.Image"] = []
+        return
     seen_xrefs: set = set()
 
-    def add_pil(blob: bytes) -> None:
-        try:
-            pil = Image.open(io.BytesIO(blob))
-            out.append(pil)
-        except Exception:
-            pass
-
     for page_no in range(len(doc)):
         page = doc[page_no]
         for item in page.get_images():
@@ -170,14 +234,9 @@ def _extract_embedded_images(doc: "fitz.Document") -> List["Image.Image"]:
             if xref in seen_xrefs:
                 continue
             seen_xrefs.add(xref)
-            try:
-                base = doc.extract_image(xref)
-                if base:
-                    blob = base.get("image") or base.get("data")
-                    if blob:
-                        add_pil(blob)
-            except Exception:
-                continue
+            pil = _xref_to_pil(doc, xref)
+            if pil is not None:
+                yield page_no, pil
         try:
             d = page.get_text("dict")
             for block in d.get("blocks") or []:
@@ -185,40 +244,76 @@ def _extract_embedded_images(doc: "fitz.Document") -> List["Image.Image"]:
                     continue
                 blob = block.get("image")
                 if blob:
-                    add_pil(blob)
+                    pil = _open_pil(blob)
+                    if pil is not None:
+                        yield page_no, pil
         except Exception:
             continue
 
-    # Some PDFs store images so they are not listed in get_images(); try all xrefs
+    # Some PDFs store images so they are not listed in get_images(); try all xrefs.
+    # Not needed when passes 1-2 already covered every page: most xrefs are fonts/metadata.
+    if already_found is not None and already_found():
+        return
     try:
         for xref in range(1, doc.xref_length()):
-            if xref in seen_xrefs:
-                continue
-            try:
-                base = doc.extract_image(xref)
-                if base:
-                    seen_xrefs.add(xref)
-                    blob = base.get("image") or base.get("data")
-                    if blob:
-                        add_pil(blob)
-            except Exception:
+            if xref in seen_xrefs or not doc.xref_is_image(xref):
                 continue
+            pil = _xref_to_pil(doc, xref)
+            if pil is not None:
+                yield None, pil
     except Exception:
         pass
 
-    return out
+
+# PyMuPDF не потокобезопасен: рендер страниц — только под этой блокировкой
+_FITZ_LOCK = threading.Lock()
+
+# Each in-flight page holds its render (plus the x2 upscale on a miss, ~60 MP) and the
+# decoders' copies: several hundred MB per worker. Keep the pool small regardless of
+# os.cpu_count(), which in a container reports the host's cores, not the CPU limit.
+_MAX_PAGE_WORKERS = 4
+
+
+def _decode_page(doc: "fitz.Document", page_no: int, dpi: int, debug_path: Optional[str] = None) -> List[str]:
+    """
+    Render one page and decode its QR codes. Safe to call from worker threads:
+    rendering is serialized by _FITZ_LOCK, decoding (zbar/OpenCV, native code) runs in parallel.
+    """
+    import sys
+    with _FITZ_LOCK:
+        img = _page_to_pil_image(doc, page_no, dpi=dpi)
+    if img is None:
+        return []
+    if debug_path:
+        try:
+            img.save(debug_path)
+            print(f"Debug: saved first page render to {debug_path}", file=sys.stderr)
+        except Exception:
+            pass
+    found = _decode_qr_from_image(img)
+    # x2 upscale only when the render itself gave no UPNQR
+    if not _has_upnqr(found) and img.width * img.height < 4000 * 4000 and _cv2_decode is not None:
+        try:
+            from PIL import Image as PILImage
+            w, h = img.size
+            img2 = img.resize((w * 2, h * 2), PILImage.Resampling.LANCZOS)
+            found.extend(_decode_qr_from_image(img2))
+        except Exception:
+            pass
+    return found
 
 
-def extract_qr_strings_from_pdf(pdf_path: str, dpi: int = 300, verbose: bool = False) -> List[str]:
+def extract_qr_strings_from_pdf(pdf_path: str, dpi: int = 400, verbose: bool = False) -> List[str]:
     """
     Extract all QR codes from PDF pages; return list of decoded strings.
-    Uses: (1) embedded images, (2) page render at several DPIs.
+    Uses: (1) embedded images, (2) page render at dpi, then 600 DPI for pages that missed.
+    Pages whose embedded images already gave a UPN QR are not rendered.
     """
     import sys
     if fitz is None:
         raise RuntimeError("PyMuPDF (fitz) required. Install: pip install pymupdf")
     if _pyzbar_decode is None and _cv2_decode is None:
-        raise RuntimeError("QR decoder required: pip install pyzbar (and zbar) or opencv-python-headless")
+        raise RuntimeError("QR decoder required: pip install fastzbarlight, pyzbar (and zbar) or opencv-python-headless")
 
     result: List[str] = []
     doc = fitz.open(pdf_path)
@@ -228,40 +323,48 @@ def extract_qr_strings_from_pdf(pdf_path: str, dpi: int = 300, verbose: bool = F
 
     try:
         # 1) Embedded images
-        embedded = _extract_embedded_images(doc)
+        # Every embedded image is decoded: each page may carry its own UPN QR
+        n_embedded = 0
+        upn_pages: set = set()  # pages that already gave a UPN QR from an embedded image
+        for page_no, pil in _extract_embedded_images(doc, already_found=lambda: len(upn_pages) == n_pages):
+            n_embedded += 1
+            found = _decode_qr_from_image(pil)
+            pil.close()
+            if page_no is not None and _has_upnqr(found):
+                upn_pages.add(page_no)
+            result.extend(found)
         if verbose:
-            print(f"Embedded images: {len(embedded)}", file=sys.stderr)
-        for pil in embedded:
-            result.extend(_decode_qr_from_pil(pil))
+            print(f"Embedded images: {n_embedded}", file=sys.stderr)
         if verbose and result:
             print(f"QR from embedded: {len(result)}", file=sys.stderr)
 
-        # 2) Always render each page too (UPN QR may be vector, only visible on render; embedded may be other QR)
-        for try_dpi in (dpi, 400, 600):
-            for page_no in range(n_pages):
-                img = _page_to_pil_image(doc, page_no, dpi=try_dpi)
-                if img is not None:
-                    if verbose and page_no == 0 and try_dpi == dpi:
-                        try:
-                            debug_path = pdf_path + ".page0_%ddpi.png" % try_dpi
-                            img.save(debug_path)
-                            print(f"Debug: saved first page render to {debug_path}", file=sys.stderr)
-                        except Exception:
-                            pass
-                    n_before = len(result)
-                    result.extend(_decode_qr_from_image(img))
-                    if img.width * img.height < 4000 * 4000 and _cv2_decode is not None:
-                        try:
-                            from PIL import Image as PILImage
-                            w, h = img.size
-                            img2 = img.resize((w * 2, h * 2), PILImage.Resampling.LANCZOS)
-                            result.extend(_decode_qr_from_image(img2))
-                        except Exception:
-                            pass
-                    if verbose and len(result) > n_before:
-                        print(f"QR from render page {page_no + 1} @ {try_dpi} DPI: +{len(result) - n_before}", file=sys.stderr)
-            if any(s.strip().startswith("UPNQR") for s in result):
-                break
+        # 2) Render the other pages (UPN QR may be vector, only visible on render; embedded may be other QR).
+        # A page that already gave UPNQR is not rendered again at higher DPI.
+        # Pages are decoded in parallel; results are merged in page order.
+        pending = [page_no for page_no in range(n_pages) if page_no not in upn_pages]
+        if not pending:
+            return result
+        # 400 DPI gives a standard UPN QR on A4 enough pixels per module; 600 DPI is the retry
+        dpi_ladder = [dpi, 600] if dpi < 600 else [dpi]
+        workers = max(1, min(len(pending), os.cpu_count() or 1, _MAX_PAGE_WORKERS))
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            for try_dpi in dpi_ladder:
+                debug_path = pdf_path + ".page0_%ddpi.png" % try_dpi if verbose and try_dpi == dpi else None
+                futures = [
+                    pool.submit(_decode_page, doc, page_no, try_dpi, debug_path if page_no == 0 else None)
+                    for page_no in pending
+                ]
+                still_pending = []
+                for page_no, fut in zip(pending, futures):
+                    found = fut.result()
+                    if verbose and found:
+                        print(f"QR from render page {page_no + 1} @ {try_dpi} DPI: +{len(found)}", file=sys.stderr)
+                    result.extend(found)
+                    if not _has_upnqr(found):
+                        still_pending.append(page_no)
+                pending = still_pending
+                if not pending:
+                    break
     finally:
         doc.close()
     return result
@@ -28,6 +28,10 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Socket timeout (s) for IMAP/SMTP: connections stay open between poll cycles, and one
+# silently dropped by a NAT/firewall would otherwise block noop() for ~15 min (TCP retransmits)
+_SOCKET_TIMEOUT = 60
+
 
 def _env(name: str, default: str = "") -> str:
     v = os.environ.get(name, default).strip()
@@ -121,8 +125,87 @@ def process_attachment(pdf_bytes: bytes, original_name: str, out_dir: Path) -> t
             pass
 
 
-def send_reply(config: dict, to_addr: str, subject: str, body: str, attachments: list) -> None:
+class MailConnections:
+    """
+    IMAP and SMTP connections kept open across poll cycles.
+    Before reuse each connection is checked with NOOP and reopened if the server dropped it.
+    """
+
+    def __init__(self, config: dict):
+        self.config = config
+        self._imap = None
+        self._smtp = None
+
+    def imap(self) -> imaplib.IMAP4:
+        """Logged-in IMAP connection (raises imaplib.IMAP4.error if login fails)."""
+        if self._imap is not None:
+            try:
+                self._imap.noop()
+                return self._imap
+            except Exception:
+                logger.info("IMAP connection lost, reconnecting")
+                self.close_imap()
+        imap = imaplib.IMAP4_SSL(
+            self.config["imap_host"], self.config["imap_port"], timeout=_SOCKET_TIMEOUT
+        )
+        try:
+            imap.login(self.config["imap_user"], self.config["imap_password"])
+        except imaplib.IMAP4.error:
+            try:
+                imap.shutdown()
+            except Exception:
+                pass
+            raise
+        self._imap = imap
+        return imap
+
+    def smtp(self) -> smtplib.SMTP:
+        """Logged-in SMTP connection."""
+        if self._smtp is not None:
+            try:
+                if self._smtp.noop()[0] == 250:
+                    return self._smtp
+            except (smtplib.SMTPException, OSError):
+                pass
+            logger.info("SMTP connection lost, reconnecting")
+            self.close_smtp()
+        smtp = smtplib.SMTP(
+            self.config["smtp_host"], self.config["smtp_port"], timeout=_SOCKET_TIMEOUT
+        )
+        try:
+            if self.config["smtp_use_tls"]:
+                smtp.starttls()
+            smtp.login(self.config["smtp_user"], self.config["smtp_password"])
+        except Exception:
+            smtp.close()
+            raise
+        self._smtp = smtp
+        return smtp
+
+    def close_imap(self) -> None:
+        if self._imap is not None:
+            try:
+                self._imap.logout()
+            except Exception:
+                pass
+            self._imap = None
+
+    def close_smtp(self) -> None:
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except Exception:
+                self._smtp.close()
+            self._smtp = None
+
+    def close(self) -> None:
+        self.close_imap()
+        self.close_smtp()
+
+
+def send_reply(conn: MailConnections, to_addr: str, subject: str, body: str, attachments: list) -> None:
     """Send email via SMTP. attachments: list of (filename, filepath or bytes)."""
+    config = conn.config
     msg = MIMEMultipart()
     msg["From"] = config["from_email"]
     msg["To"] = to_addr
@@ -137,20 +220,22 @@ def send_reply(config: dict, to_addr: str, subject: str, body: str, attachments:
         part = MIMEApplication(data, _subtype="pdf")
         part.add_header("Content-Disposition", "attachment", filename=name)
         msg.attach(part)
-    with smtplib.SMTP(config["smtp_host"], config["smtp_port"]) as smtp:
-        if config["smtp_use_tls"]:
-            smtp.starttls()
-        smtp.login(config["smtp_user"], config["smtp_password"])
-        smtp.sendmail(config["from_email"], [to_addr], msg.as_string())
+    raw = msg.as_string()
+    try:
+        conn.smtp().sendmail(config["from_email"], [to_addr], raw)
+    except smtplib.SMTPServerDisconnected:
+        # Server closed the connection between NOOP and send: reconnect once
+        conn.close_smtp()
+        conn.smtp().sendmail(config["from_email"], [to_addr], raw)
     logger.info("Reply sent to %s | subject: %s", to_addr, subject)
 
 
-def run_once(config: dict) -> None:
+def run_once(conn: MailConnections) -> None:
+    config = conn.config
     with tempfile.TemporaryDirectory() as tmp:
         out_dir = Path(tmp)
-        imap = imaplib.IMAP4_SSL(config["imap_host"], config["imap_port"])
         try:
-            imap.login(config["imap_user"], config["imap_password"])
+            imap = conn.imap()
         except imaplib.IMAP4.error as e:
             logger.error("IMAP login failed: %s", e)
             return
@@ -186,7 +271,7 @@ def run_once(config: dict) -> None:
                 reply_subject = "RE: " + (subject or "(no subject)")
                 try:
                     send_reply(
-                        config,
+                        conn,
                         from_addr,
                         reply_subject,
                         body,
@@ -204,7 +289,6 @@ def run_once(config: dict) -> None:
                 imap.expunge()
             except Exception:
                 pass
-            imap.logout()
 
 
 def main() -> int:
@@ -217,12 +301,18 @@ def main() -> int:
         "Started: IMAP %s, SMTP %s, poll every %ds",
         config["imap_host"], config["smtp_host"], config["poll_interval"],
     )
-    while True:
-        try:
-            run_once(config)
-        except Exception as e:
-            logger.exception("Run error: %s", e)
-        time.sleep(config["poll_interval"])
+    conn = MailConnections(config)
+    try:
+        while True:
+            try:
+                run_once(conn)
+            except Exception as e:
+                logger.exception("Run error: %s", e)
+                # Connection state is unknown after an error: start fresh next cycle
+                conn.close()
+            time.sleep(config["poll_interval"])
+    finally:
+        conn.close()
     return 0
 
 
@@ -4,11 +4,15 @@
 Спецификация: UPN QR (upn-qr.si), формат — строки, разделённые \\n.
 """
 import re
-from typing import List, Optional
+import sys
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
 
-from upn_parser import UPNPayment
+from upn_parser import UPNPayment, _WS_DELETE
 
 
+_NONDIGIT_RE = re.compile(r"\D")
+
 # Порядок полей в UPN QR (по py-upn-qr и NavodilaZaProgramerjeUPNQR):
 # 0: UPNQR
 # 1-4: резерв
@@ -25,35 +29,41 @@ from upn_parser import UPNPayment
 
 
 def _normalize_iban(iban: str) -> str:
-    return re.sub(r"\s+", "", (iban or "").strip()).upper()
+    return sys.intern((iban or "").strip().translate(_WS_DELETE).upper())
 
 
 def _parse_upn_amount(znesek_11: str) -> Optional[float]:
     """Парсит сумму из 11 цифр (последние 2 — копейки)."""
     s = (znesek_11 or "").strip()
-    s = re.sub(r"\D", "", s)
-    if len(s) != 11:
-        return None
+    # Обычный случай — поле уже из 11 цифр; isdecimal() совпадает с \d, regex не нужен
+    if len(s) != 11 or not s.isdecimal():
+        s = _NONDIGIT_RE.sub("", s)
+        if len(s) != 11:
+            return None
     try:
         return int(s) / 100.0
     except ValueError:
         return None
 
 
+# Одинаковые QR (повторно напечатанные поручения, один QR на нескольких страницах) разбираются один раз;
+# UPNPayment неизменяемый, поэтому общий объект из кэша безопасен
+@lru_cache(maxsize=1024)
 def parse_unp_qr_content(qr_string: str) -> Optional[UPNPayment]:
     """
     Парсит одну строку — содержимое декодированного UNP QR кода.
     Возвращает UPNPayment или None, если строка не является валидным UPNQR.
     """
-    if not qr_string or not qr_string.strip():
+    s = (qr_string or "").strip()
+    # Быстрый отсев не-UPN содержимого (URL, EPC и т.п.) до разбиения на строки
+    if not s.startswith("UPNQR"):
         return None
-    lines = [ln.strip() for ln in qr_string.strip().split("\n")]
-    # Убираем последнюю строку, если это 3-значная контрольная сумма
-    if len(lines) > 19 and lines[-1].isdigit() and len(lines[-1]) == 3:
-        lines = lines[:-1]
+    # Строки не обрезаются заранее: strip() только для полей, которые читаем.
+    # Контрольная сумма (20-я строка) не мешает — читаются только поля 0–18.
+    lines = s.split("\n")
     if len(lines) < 19:
         return None
-    if lines[0] != "UPNQR":
+    if lines[0].strip() != "UPNQR":
         return None
 
     znesek_val = _parse_upn_amount(lines[8])
@@ -64,35 +74,30 @@ def parse_unp_qr_content(qr_string: str) -> Optional[UPNPayment]:
     if not iban.startswith("SI") or len(iban) != 19:
         return None
 
-    recipient_name = (lines[16] or "").strip()
-    recipient_address = " ".join(filter(None, [lines[17], lines[18]])).strip()
-    reference = (lines[15] or "").strip()
-    purpose_code = (lines[11] or "").strip()[:4]
-    purpose_text = (lines[12] or "").strip()
+    recipient_name = lines[16].strip()
+    recipient_address = " ".join(filter(None, [lines[17].strip(), lines[18].strip()]))
+    # IBAN и референс интернируются: ключ дедупликации сравнивается по указателю
+    reference = sys.intern(lines[15].strip())
+    purpose_code = lines[11].strip()[:4]
+    purpose_text = lines[12].strip()
     purpose = purpose_text or purpose_code or "UPN payment"
 
     return UPNPayment(
-        recipient_name=recipient_name or "Recipient",
-        recipient_address=recipient_address,
-        iban=iban,
-        amount=znesek_val,
-        reference=reference,
-        purpose=purpose,
-        payer_reference="",
+        recipient_name or "Recipient",
+        recipient_address,
+        iban,
+        znesek_val,
+        reference,
+        purpose,
+        "",  # payer_reference
     )
 
 
 def parse_all_unp_qr_contents(qr_strings: List[str]) -> List[UPNPayment]:
     """Парсит список строк (содержимое нескольких QR). Убирает дубликаты по (iban, reference, amount)."""
-    seen = set()
-    payments: List[UPNPayment] = []
-    for s in qr_strings:
-        p = parse_unp_qr_content(s)
-        if p is None:
-            continue
-        key = (p.iban, p.reference, p.amount)
-        if key in seen:
-            continue
-        seen.add(key)
-        payments.append(p)
-    return payments
+    # dict сохраняет порядок вставки; setdefault оставляет первое вхождение ключа
+    unique: Dict[Tuple[str, str, float], UPNPayment] = {}
+    for p in map(parse_unp_qr_content, qr_strings):
+        if p is not None:
+            unique.setdefault((p.iban, p.reference, p.amount), p)
+    return list(unique.values())
@@ -3,13 +3,45 @@
 Извлечение платёжных данных UPN/UNP из текста словенских платёжных поручений.
 """
 import re
+import sys
+from collections import deque
 from dataclasses import dataclass
-from typing import List, Optional
-
-
-@dataclass
+from typing import Deque, List, Optional, Tuple
+
+
+# Все пробельные символы (ровно то, что матчит \s / str.isspace) — удаляются через str.translate
+_WS_DELETE = str.maketrans(
+    "", "", "\t\n\x0b\x0c\r\x1c\x1d\x1e\x1f \x85\xa0\u1680\u2000\u2001\u2002\u2003\u2004"
+    "\u2005\u2006\u2007\u2008\u2009\u200a\u2028\u2029\u202f\u205f\u3000"
+)
+
+# Регулярные выражения компилируются один раз (вызываются на каждой строке текста)
+_WS_RE = re.compile(r"\s+")
+_SI19_SPACED_RE = re.compile(r"^SI19\s+[\d\-]+$")    # ссылка SI19 с разделителем после SI19
+# Классификация строки одним проходом (строка уже без пробелов по краям):
+#   amount — ***28,74; si19 — SI19 xxxxx-xxxxx (пробелы допускаются где угодно);
+#   iban — SI56 и дальше только цифры; rf — RFxx.
+# В каждом повторении один класс символов, соседние повторения не пересекаются —
+# неоднозначного перебора (как у "SI\d{2}\s*[\d\s]+") нет, время линейно по длине строки.
+_LINE_CLASS_RE = re.compile(
+    r"(?P<amount>\*+\s*\d+[,\.]\d{2}\s*$)"
+    r"|(?P<si19>S\s*I\s*1\s*9\s*[\d\-][\d\-\s]*$)"
+    r"|(?P<iban>SI56\s*\d[\d\s]*$)"
+    r"|(?P<rf>RF\d{2}\s*$)"
+)
+_LINE_CLASS_FIRST = frozenset("*SR")
+_ACCOUNT_NO_RE = re.compile(r"^\d{10}\s*$")
+# Ключевые слова в тексте строки: назначение (Prispevek) и служебные строки банка (LBRI, LT10)
+_KEYWORD_RE = re.compile(r"Prispevek|LBRI|LT10")
+# Непустая строка сразу без пробелов по краям: от первого до последнего непробельного символа.
+# В классе — все разделители строк, на которых режет str.splitlines(). Совпадение начинается с \S,
+# поэтому пробельные строки отбрасываются за шаг на символ, без квадратичного перебора.
+_NONBLANK_LINE_RE = re.compile(r"\S(?:[^\n\r\x0b\x0c\x1c-\x1e\x85\u2028\u2029]*\S)?")
+
+
+@dataclass(slots=True, frozen=True)
 class UPNPayment:
-    """Один платёж из UPN."""
+    """Один платёж из UPN (неизменяемый, без __dict__). Создаётся позиционно — порядок полей не менять."""
     recipient_name: str
     recipient_address: str
     iban: str
@@ -19,124 +51,148 @@ class UPNPayment:
     payer_reference: str    # RFxx - sklic na plačnika (опционально)
 
 
-def _normalize_iban(iban: str) -> str:
-    """Убирает пробелы из IBAN для хранения и EPC."""
-    return re.sub(r"\s+", "", iban.strip()).upper()
+def _is_si56_iban(compact: str) -> bool:
+    """IBAN SI56 в форме без пробелов: после SI56 только цифры (\\d == isdecimal). Длину не проверяет."""
+    return compact.startswith("SI56") and compact[4:].isdecimal()
 
 
 def _parse_amount(s: str) -> Optional[float]:
     """Парсит сумму вида ***28,74 или 28,74."""
-    s = s.strip()
-    s = re.sub(r"^\*+", "", s)
-    s = s.replace(",", ".")
+    s = s.strip().lstrip("*").replace(",", ".")
     try:
         return float(s)
     except ValueError:
         return None
 
 
-def extract_upn_payments(text: str) -> List[UPNPayment]:
+# Классы строк (одна метка на строку, классы не пересекаются)
+_TAG_TEXT, _TAG_AMOUNT, _TAG_SI19, _TAG_IBAN, _TAG_RF, _TAG_PURPOSE, _TAG_LBRI = range(7)
+_TAG_BY_GROUP = {"amount": _TAG_AMOUNT, "si19": _TAG_SI19, "iban": _TAG_IBAN, "rf": _TAG_RF}
+
+
+def _line_tag(line: str) -> int:
+    """Класс строки (строка уже без пробелов по краям)."""
+    # Все классы _LINE_CLASS_RE начинаются с "*", "S" или "R" — остальные строки в regex не отправляем
+    if line[:1] in _LINE_CLASS_FIRST:
+        m = _LINE_CLASS_RE.match(line)
+        if m is not None:
+            return _TAG_BY_GROUP[m.lastgroup]
+    k = _KEYWORD_RE.search(line)
+    if k is None:
+        return _TAG_TEXT
+    # "Prispevek" важнее LBRI/LT10, даже если встречается в строке позже
+    if k.group() == "Prispevek" or "Prispevek" in line[k.end():]:
+        return _TAG_PURPOSE
+    return _TAG_LBRI
+
+
+def _classify_lines(lines: List[str]) -> Tuple[bytes, List[str]]:
     """
-    Извлекает все платёжные блоки UPN из текста (например, из PDF).
-    Ориентируется на повторяющиеся блоки: IBAN (SI56), сумма (***X,XX), ссылка SI19.
+    Один проход по строкам: метки (по байту на строку) и строки без пробелов.
+    _TAG_IBAN — IBAN SI56 (строка начинается с "SI56", дальше только цифры), длина не проверяется.
+    _TAG_LBRI — строка с LBRI/LT10 (для имён не подходит в fallback-парсере, остальным — обычный текст).
+    Строка со схлопнутыми пробелами нужна только для имён/назначения и считается по месту.
     """
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-    payments: List[UPNPayment] = []
-    i = 0
+    tags = bytes([_line_tag(ln) for ln in lines])
+    compacts = [ln.translate(_WS_DELETE) for ln in lines]
+    return tags, compacts
 
-    iban_re = re.compile(r"^SI\d{2}\s*[\d\s]+$")
-    si19_re = re.compile(r"^SI19\s+[\d\-]+$")
-    amount_re = re.compile(r"^\*+\s*[\d]+[,\.]\d{2}\s*$")
 
-    while i < len(lines):
-        line = lines[i]
-        # Ищем строку с IBAN (SI56 ...)
-        if not iban_re.match(re.sub(r"\s+", "", line)) or "SI56" not in line:
-            i += 1
-            continue
+def _split_lines(text: str) -> List[str]:
+    return _NONBLANK_LINE_RE.findall(text)
 
-        iban = _normalize_iban(line)
-        if not iban.startswith("SI56") or len(iban) != 19:
-            i += 1
-            continue
 
-        # Следующие строки: название получателя, адрес, назначение
-        recipient_name = ""
-        recipient_address = ""
-        purpose = ""
-        ref_si19 = ""
-        amount_val: Optional[float] = None
-        payer_ref = ""
+@dataclass(slots=True)
+class _OpenBlock:
+    """Блок, начатый строкой IBAN и ещё не закрытый (для extract_upn_payments)."""
+    start: int                          # индекс строки с первым IBAN
+    iban: str
+    names_offset: int                   # начало своих кандидатов в общем списке имён
+    names: Optional[List[str]] = None   # фиксируется при первой ссылке SI19 после start
 
-        j = i + 1
-        name_candidates: List[str] = []
-        address_candidates: List[str] = []
-
-        while j < len(lines):
-            cur = lines[j]
-            cur_clean = re.sub(r"\s+", " ", cur)
-
-            if iban_re.match(re.sub(r"\s+", "", cur)) and "SI56" in cur:
-                # Второй раз IBAN в блоке — после него идут SI19 и сумма
-                if j + 1 < len(lines) and si19_re.match(lines[j + 1].replace(" ", "")):
-                    ref_si19 = re.sub(r"\s+", "", lines[j + 1])
-                if j + 2 < len(lines) and amount_re.match(lines[j + 2]):
-                    amount_val = _parse_amount(lines[j + 2])
-                if amount_val is not None and ref_si19:
-                    # Имя и адрес — всё между первым IBAN и вторым IBAN
-                    if name_candidates:
-                        recipient_name = name_candidates[0]
-                    if len(name_candidates) > 1:
-                        recipient_address = " ".join(name_candidates[1:])
-                    if purpose:
-                        pass  # уже есть
-                    break
-                j += 1
-                continue
 
-            if si19_re.match(re.sub(r"\s+", "", cur)):
-                ref_si19 = re.sub(r"\s+", "", cur)
-                j += 1
-                continue
-            if amount_re.match(cur):
-                amount_val = _parse_amount(cur)
-                j += 1
-                continue
-            if re.match(r"^RF\d{2}\s*$", cur):
-                payer_ref = cur.strip()
-                j += 1
-                continue
-
-            # До второго вхождения IBAN — имя/адрес/назначение
-            if not ref_si19 and not amount_re.match(cur):
-                if not recipient_name and cur_clean and len(cur_clean) > 2:
-                    name_candidates.append(cur_clean)
-                elif recipient_name and not purpose and "Prispevek" in cur:
-                    purpose = cur_clean
-                elif recipient_name and purpose and "Prispevek" in cur:
-                    purpose = cur_clean
-            j += 1
+def extract_upn_payments(text: str) -> List[UPNPayment]:
+    """
+    Извлекает все платёжные блоки UPN из текста (например, из PDF).
+    Ориентируется на повторяющиеся блоки: IBAN (SI56), сумма (***X,XX), ссылка SI19.
+    Один проход: каждый IBAN открывает блок, блок закрывается на следующем IBAN,
+    после которого уже известны ссылка SI19 и сумма.
+    """
+    lines = _split_lines(text)
+    tags, compacts = _classify_lines(lines)
+    n = len(lines)
+    payments: List[UPNPayment] = []
 
-        if amount_val is not None and amount_val > 0 and ref_si19 and iban:
-            if not recipient_name and name_candidates:
-                recipient_name = name_candidates[0]
-            if len(name_candidates) > 1:
-                recipient_address = " ".join(name_candidates[1:])
-            if not purpose:
-                purpose = "UPN payment"
-            payments.append(
-                UPNPayment(
-                    recipient_name=recipient_name or "Recipient",
-                    recipient_address=recipient_address,
-                    iban=iban,
-                    amount=amount_val,
-                    reference=ref_si19,
-                    purpose=purpose,
-                    payer_reference=payer_ref,
-                )
+    # Все открытые блоки видят одни и те же строки, поэтому достаточно помнить
+    # последнее значение и индекс строки, где оно встретилось: блок «видел» его,
+    # если индекс больше start. Старые блоки видели всё, что видели новые,
+    # поэтому закрываются всегда с начала очереди.
+    open_blocks: Deque[_OpenBlock] = deque()
+    unreffed: List[_OpenBlock] = []     # блоки, для которых ещё не было ссылки SI19
+    pending_names: List[str] = []       # имя/адрес после последней ссылки SI19
+    amount_val: Optional[float] = None
+    amount_at = -1
+    ref_si19 = ""
+    ref_at = -1
+    payer_ref = ""
+    payer_ref_at = -1
+
+    def emit(block: _OpenBlock) -> None:
+        if amount_val is None or amount_val <= 0:
+            return
+        names = block.names or []
+        payments.append(
+            UPNPayment(
+                (names[0] if names else "") or "Recipient",
+                " ".join(names[1:]) if len(names) > 1 else "",
+                block.iban,
+                amount_val,
+                ref_si19,
+                "UPN payment",  # purpose
+                payer_ref if payer_ref_at > block.start else "",
             )
-
-        i += 1
+        )
+
+    for j in range(n):
+        tag = tags[j]
+
+        if tag == _TAG_IBAN:
+            # IBAN в блоке — после него идут SI19 и сумма
+            if j + 1 < n and _SI19_SPACED_RE.match(lines[j + 1].replace(" ", "")):
+                ref_si19 = sys.intern(compacts[j + 1])
+                ref_at = j
+                # Имя и адрес — всё между IBAN блока и этой ссылкой
+                for block in unreffed:
+                    block.names = pending_names[block.names_offset:]
+                unreffed.clear()
+                pending_names = []
+            if j + 2 < n and tags[j + 2] == _TAG_AMOUNT:
+                amount_val = _parse_amount(lines[j + 2])
+                amount_at = j
+            if amount_val is not None:
+                ready_before = min(ref_at, amount_at)
+                while open_blocks and open_blocks[0].start < ready_before:
+                    emit(open_blocks.popleft())
+            compact = compacts[j]
+            if len(compact) == 19:
+                block = _OpenBlock(j, sys.intern(compact.upper()), len(pending_names))
+                open_blocks.append(block)
+                unreffed.append(block)
+        elif tag == _TAG_AMOUNT:
+            amount_val = _parse_amount(lines[j])
+            amount_at = j
+        elif tag == _TAG_RF:
+            payer_ref = lines[j]
+            payer_ref_at = j
+        elif unreffed:
+            clean = _WS_RE.sub(" ", lines[j])
+            if len(clean) > 2:
+                pending_names.append(clean)
+
+    # Незакрытые блоки: платёж есть, если после IBAN встретились и ссылка, и сумма
+    for block in open_blocks:
+        if ref_at > block.start and amount_at > block.start:
+            emit(block)
 
     return payments
 
@@ -145,24 +201,16 @@ def extract_upn_payments_v2(text: str) -> List[UPNPayment]:
     """
     Альтернативный парсер: ищем блоки по паттерну SI19 + сумма подряд.
     """
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    lines = _split_lines(text)
+    tags, compacts = _classify_lines(lines)
+    n = len(lines)
     payments: List[UPNPayment] = []
     seen = set()
 
-    iban_re = re.compile(r"^SI56\s*[\d\s]+$")
-    si19_re = re.compile(r"^SI19\s*[\d\-]+$")
-    amount_re = re.compile(r"^\*+\s*[\d]+[,\.]\d{2}\s*$")
-
     i = 0
-    while i < len(lines):
-        line = lines[i]
-        # Ищем SI19
-        if not si19_re.match(re.sub(r"\s+", "", line)):
-            i += 1
-            continue
-        ref_si19 = re.sub(r"\s+", "", line)
-        # Следующая строка — сумма
-        if i + 1 >= len(lines) or not amount_re.match(lines[i + 1]):
+    while i < n:
+        # Ищем SI19, следующая строка — сумма
+        if tags[i] != _TAG_SI19 or i + 1 >= n or tags[i + 1] != _TAG_AMOUNT:
             i += 1
             continue
         amount_val = _parse_amount(lines[i + 1])
@@ -177,41 +225,39 @@ def extract_upn_payments_v2(text: str) -> List[UPNPayment]:
         purpose = ""
         payer_ref = ""
 
-        for k in range(i - 1, max(-1, i - 25), -1):
-            cur = lines[k]
-            cur_clean = re.sub(r"\s+", " ", cur)
-            if iban_re.match(re.sub(r"\s+", "", cur)) and "SI56" in cur and len(re.sub(r"\s+", "", cur)) == 19:
-                iban = _normalize_iban(cur)
+        lo = max(0, i - 24)
+        k = tags.rfind(_TAG_IBAN, lo, i)
+        while k >= 0:
+            if len(compacts[k]) == 19:
+                iban = sys.intern(compacts[k].upper())
                 break
+            k = tags.rfind(_TAG_IBAN, lo, k)
 
         if not iban:
             i += 1
             continue
+        ref_si19 = sys.intern(compacts[i])
 
         # Имя и назначение: в PDF после SI19 и двух строк ***сумма идут NAME, ADDRESS, RFxx, SI19, PURPOSE
         name_lines = []
         j = i + 3  # после SI19, ***, ***
-        while j < len(lines):
-            ln = lines[j]
-            ln_clean = re.sub(r"\s+", " ", ln)
-            if amount_re.match(ln) or si19_re.match(re.sub(r"\s+", "", ln)):
+        while j < n:
+            ln_tag = tags[j]
+            if ln_tag == _TAG_AMOUNT or ln_tag == _TAG_SI19:
                 j += 1
                 continue
-            if re.match(r"^RF\d{2}\s*$", ln):
-                payer_ref = ln.strip()
+            if ln_tag == _TAG_RF:
+                payer_ref = lines[j]
                 j += 1
                 continue
-            if "Prispevek" in ln and not name_lines:
+            if ln_tag == _TAG_PURPOSE:
                 # назначение может идти после RF и второго SI19
-                purpose = ln_clean
-                j += 1
-                break
-            if "Prispevek" in ln:
-                purpose = ln_clean
+                purpose = _WS_RE.sub(" ", lines[j])
                 j += 1
                 break
-            if ln and re.sub(r"\s+", "", ln) != ref_si19 and "SI56" not in ln:
-                name_lines.append(ln_clean)
+            ln = lines[j]
+            if ln and compacts[j] != ref_si19 and "SI56" not in ln:
+                name_lines.append(_WS_RE.sub(" ", ln))
             j += 1
             if purpose and len(name_lines) >= 1:
                 break
@@ -227,13 +273,13 @@ def extract_upn_payments_v2(text: str) -> List[UPNPayment]:
             seen.add(key)
             payments.append(
                 UPNPayment(
-                    recipient_name=recipient_name or "Recipient",
-                    recipient_address=recipient_address,
-                    iban=iban,
-                    amount=amount_val,
-                    reference=ref_si19,
-                    purpose=purpose,
-                    payer_reference=payer_ref,
+                    recipient_name or "Recipient",
+                    recipient_address,
+                    iban,
+                    amount_val,
+                    ref_si19,
+                    purpose,
+                    payer_ref,
                 )
             )
         i += 1
@@ -247,16 +293,15 @@ def extract_upn_payments_from_text_fallback(text: str) -> List[UPNPayment]:
     ***сумма, ***сумма, SI56, SI19, ... (LBRI/дата), SI56, PREHODNI/имя, адрес, ...
     Ищем пары *** и затем в следующих строках SI56 и SI19.
     """
-    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    lines = _split_lines(text)
+    tags, compacts = _classify_lines(lines)
+    n = len(lines)
     payments: List[UPNPayment] = []
     seen = set()
-    iban_re = re.compile(r"^SI56\s*[\d\s]+$")
-    si19_re = re.compile(r"^SI19\s*[\d\-]+$")
-    amount_re = re.compile(r"^\*+\s*[\d]+[,\.]\d{2}\s*$")
 
     i = 0
-    while i < len(lines):
-        if not amount_re.match(lines[i]):
+    while i < n:
+        if tags[i] != _TAG_AMOUNT:
             i += 1
             continue
         amount_val = _parse_amount(lines[i])
@@ -265,18 +310,17 @@ def extract_upn_payments_from_text_fallback(text: str) -> List[UPNPayment]:
             continue
         # Пропускаем возможную вторую строку ***
         j = i + 1
-        if j < len(lines) and amount_re.match(lines[j]):
+        if j < n and tags[j] == _TAG_AMOUNT:
             j += 1
         # Ищем SI56 затем SI19 в следующих ~15 строках
         iban = ""
         ref_si19 = ""
-        for k in range(j, min(len(lines), j + 18)):
-            cur = lines[k]
-            cur_nospace = re.sub(r"\s+", "", cur)
-            if iban_re.match(cur_nospace) and "SI56" in cur and len(cur_nospace) == 19:
-                iban = _normalize_iban(cur)
-            if si19_re.match(cur_nospace):
-                ref_si19 = cur_nospace
+        for k in range(j, min(n, j + 18)):
+            cur_tag = tags[k]
+            if cur_tag == _TAG_IBAN and len(compacts[k]) == 19:
+                iban = sys.intern(compacts[k].upper())
+            elif cur_tag == _TAG_SI19:
+                ref_si19 = sys.intern(compacts[k])
                 break
         if not iban or not ref_si19:
             i += 1
@@ -284,16 +328,17 @@ def extract_upn_payments_from_text_fallback(text: str) -> List[UPNPayment]:
         # Имя получателя и назначение — строки после SI19 (часто PREHODNI DAVČNI PODRAČUN и т.д.)
         name_lines = []
         purpose = ""
-        for k in range(j + 1, min(len(lines), j + 25)):
-            ln = lines[k]
-            ln_clean = re.sub(r"\s+", " ", ln)
-            if "Prispevek" in ln:
-                purpose = ln_clean
+        for k in range(j + 1, min(n, j + 25)):
+            ln_tag = tags[k]
+            if ln_tag == _TAG_PURPOSE:
+                purpose = _WS_RE.sub(" ", lines[k])
                 break
-            if iban_re.match(re.sub(r"\s+", "", ln)) or si19_re.match(re.sub(r"\s+", "", ln)):
+            # SI56 здесь без проверки начала строки ("SI 56 ..." тоже пропускаем)
+            if ln_tag == _TAG_SI19 or _is_si56_iban(compacts[k]):
                 continue
-            if ln and "LBRI" not in ln and "LT10" not in ln and not re.match(r"^\d{10}\s*$", ln):
-                name_lines.append(ln_clean)
+            ln = lines[k]
+            if ln and ln_tag != _TAG_LBRI and not _ACCOUNT_NO_RE.match(ln):
+                name_lines.append(_WS_RE.sub(" ", ln))
         recipient_name = name_lines[0] if name_lines else "Recipient"
         recipient_address = " ".join(name_lines[1:]) if len(name_lines) > 1 else ""
         if not purpose:
@@ -304,13 +349,13 @@ def extract_upn_payments_from_text_fallback(text: str) -> List[UPNPayment]:
             seen.add(key)
             payments.append(
                 UPNPayment(
-                    recipient_name=recipient_name,
-                    recipient_address=recipient_address,
-                    iban=iban,
-                    amount=amount_val,
-                    reference=ref_si19,
-                    purpose=purpose,
-                    payer_reference="",
+                    recipient_name,
+                    recipient_address,
+                    iban,
+                    amount_val,
+                    ref_si19,
+                    purpose,
+                    "",  # payer_reference
                 )
             )
         i += 1